@@ -1,12 +1,26 @@
 """
 基礎 Agent 類別，定義共通的 Agent 介面。
 """
+from dataclasses import dataclass
 from typing import Dict, Any, Optional
-from pydantic import BaseModel
 
-class AgentResponse(BaseModel):
+class AgentUnavailableError(Exception):
+    """
+    Agent 不可用（尚未初始化或未註冊）。
+
+    串流路徑以例外傳遞這類狀態，讓呼叫端能把例外訊息
+    回覆給用戶，同時把失敗與正常回覆區分開來
+    （失敗回覆不應寫入語意快取）。
+    """
+    pass
+
+@dataclass(slots=True)
+class AgentResponse:
     """
     Agent 回應的資料模型。
+
+    僅在內部流動、欄位可信，使用輕量的 dataclass
+    避免每則訊息都付 Pydantic 驗證成本。
     """
     content: str
     confidence: float = 1.0
@@ -36,15 +50,32 @@ class BaseAgent:
     async def process(self, user_id: str, message: str) -> AgentResponse:
         """
         處理用戶訊息，返回回應。
-        
+
         Args:
             user_id: 用戶 ID
             message: 用戶發送的訊息
-            
+
         Returns:
             AgentResponse: 包含回覆內容與信心度等資訊
         """
         raise NotImplementedError("子類必須實作 process 方法")
+
+    async def stream(self, user_id: str, message: str):
+        """
+        串流版的 process，逐塊產出回覆文字。
+
+        預設實作等完整回覆生成後一次產出；
+        支援增量生成的子類可覆寫以降低首塊延遲。
+
+        Args:
+            user_id: 用戶 ID
+            message: 用戶發送的訊息
+
+        Yields:
+            str: 回覆文字片段
+        """
+        response = await self.process(user_id, message)
+        yield response.content
     
     async def get_metadata(self) -> Dict[str, Any]:
         """
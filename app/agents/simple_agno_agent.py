@@ -2,12 +2,27 @@
 實現基於 Agno 的簡單 Agent。
 """
 import asyncio
-from app.agents.base_agent import BaseAgent, AgentResponse
+import threading
+from app.agents.base_agent import BaseAgent, AgentResponse, AgentUnavailableError
 import logging
 from app.config import settings  # 導入 settings
 
 logger = logging.getLogger(__name__)
 
+# 串流結束的哨兵值
+_STREAM_DONE = object()
+
+# Agent 的靜態 prompt 設定：定義在模組層級，每個 process 於
+# import 時建立一次，重新建構 Agent 時直接重用同一份物件。
+# （uvicorn 的 worker 是 spawn 出來的，各自 re-import，
+# 不存在跨 process 的 copy-on-write 共享。）
+AGENT_DESCRIPTION = "你是一個友善的客服助手，負責回答用戶的問題"
+AGENT_INSTRUCTIONS = [
+    "以禮貌的方式回應用戶",
+    "如果不確定答案，坦白說明",
+    "回答要簡潔明瞭",
+]
+
 class SimpleAgnoAgent(BaseAgent):
     """
     使用 Agno 框架的簡單 Agent 實現。
@@ -23,10 +38,8 @@ class SimpleAgnoAgent(BaseAgent):
     async def initialize(self):
         """初始化 Agno Agent。"""
         logger.info("初始化 Agno Agent")
-        # 使用非同步方式初始化 Agno Agent
-        # 這樣可以避免在服務啟動時阻塞
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._init_agno_agent)
+        # 在執行緒中初始化 Agno Agent，避免在服務啟動時阻塞
+        await asyncio.to_thread(self._init_agno_agent)
         logger.info("Agno Agent 初始化完成")
     
     def _init_agno_agent(self):
@@ -48,12 +61,8 @@ class SimpleAgnoAgent(BaseAgent):
                     id="gpt-4o-mini",
                     api_key=settings.OPENAI_API_KEY  # 明確傳遞 API Key
                 ),
-                description="你是一個友善的客服助手，負責回答用戶的問題",
-                instructions=[
-                    "以禮貌的方式回應用戶",
-                    "如果不確定答案，坦白說明",
-                    "回答要簡潔明瞭"
-                ],
+                description=AGENT_DESCRIPTION,
+                instructions=AGENT_INSTRUCTIONS,
                 markdown=True,
                 # 添加下列設定以便更好地處理聊天
                 num_history_responses=10,  # 保留過去10次回應的歷史
@@ -77,40 +86,113 @@ class SimpleAgnoAgent(BaseAgent):
             AgentResponse: 包含回覆內容與信心度
         """
         if not self.agent:
-            logger.warning(f"Agent 尚未初始化完成，用戶 {user_id} 的請求無法處理")
+            logger.warning("Agent 尚未初始化完成，用戶 %s 的請求無法處理", user_id)
             return AgentResponse(
                 content="Agent 尚未初始化完成，請稍後再試",
                 confidence=0.0
             )
         
         try:
-            logger.info(f"處理來自用戶 {user_id} 的訊息: {message}")
+            logger.info("處理來自用戶 %s 的訊息: %s", user_id, message)
             
             # 設置 session_id 為用戶 ID，以保持對話上下文
-            # 使用非同步方式調用 Agno Agent
-            loop = asyncio.get_event_loop()
-            run_response = await loop.run_in_executor(
-                None, 
-                lambda: self.agent.run(
-                    message, 
-                    user_id=user_id, 
-                    session_id=user_id  # 使用用戶ID作為會話ID
-                )
+            # 透過 asyncio.to_thread 丟到預設執行緒池（於 app 啟動時設定大小）
+            run_response = await asyncio.to_thread(
+                self.agent.run,
+                message,
+                user_id=user_id,
+                session_id=user_id  # 使用用戶ID作為會話ID
             )
             
             # 從 RunResponse 對象獲取回應文本
             response_content = run_response.content
             
             # 記錄 Agno Agent 回覆內容
-            logger.debug(f"Agno Agent 回覆: {response_content}")
+            logger.debug("Agno Agent 回覆: %s", response_content)
             
             return AgentResponse(
                 content=response_content,
                 confidence=0.9  # 固定信心度，未來可以根據回應內容分析
             )
         except Exception as e:
-            logger.error(f"處理訊息時發生錯誤: {e}", exc_info=True)
+            logger.error("處理訊息時發生錯誤: %s", e, exc_info=True)
             return AgentResponse(
                 content="抱歉，處理您的請求時發生錯誤，請稍後再試",
                 confidence=0.0
-            ) 
\ No newline at end of file
+            )
+
+    async def stream(self, user_id: str, message: str):
+        """
+        串流處理用戶訊息，逐塊產出 Agno Agent 的回覆。
+
+        Agno 的串流介面是同步 generator，在執行緒中迭代並把
+        片段透過 queue 丟回事件迴圈，首塊就緒即可往下游送。
+
+        Args:
+            user_id: 用戶 ID
+            message: 用戶發送的訊息
+
+        Yields:
+            str: 回覆文字片段
+
+        Raises:
+            AgentUnavailableError: Agent 尚未初始化完成
+            Exception: 底層串流執行失敗（原樣拋出，讓呼叫端
+                區分失敗與正常回覆，避免把錯誤訊息寫入快取）
+        """
+        if not self.agent:
+            logger.warning("Agent 尚未初始化完成，用戶 %s 的請求無法處理", user_id)
+            raise AgentUnavailableError("Agent 尚未初始化完成，請稍後再試")
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        # 消費端提前離開（任務取消、事件迴圈關閉）時通知生產者停止
+        stop = threading.Event()
+
+        def _put(item):
+            """把項目丟回事件迴圈；消費端已離開或迴圈已關閉時放棄。"""
+            if stop.is_set():
+                return
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass
+
+        def _produce():
+            try:
+                events = self.agent.run(
+                    message,
+                    user_id=user_id,
+                    session_id=user_id,
+                    stream=True
+                )
+                for event in events:
+                    if stop.is_set():
+                        break
+                    content = getattr(event, "content", None)
+                    if content:
+                        _put(content)
+            except Exception as e:
+                _put(e)
+            finally:
+                _put(_STREAM_DONE)
+
+        producer = asyncio.create_task(asyncio.to_thread(_produce))
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_DONE:
+                    break
+                if isinstance(item, Exception):
+                    logger.error("串流處理訊息時發生錯誤: %s", item)
+                    stop.set()
+                    await producer
+                    raise item
+                yield item
+            await producer
+        except GeneratorExit:
+            # 生成器在未耗盡前被終結：GeneratorExit 拋在 yield 處，
+            # 此時不可再 await（會變成 async generator ignored
+            # GeneratorExit），設旗標讓生產者執行緒自行收尾
+            stop.set()
+            raise 
\ No newline at end of file
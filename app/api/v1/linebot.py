@@ -1,82 +1,62 @@
 """
 LINE Bot webhook API endpoints.
 """
-from fastapi import APIRouter, Request, HTTPException, Depends, Header, BackgroundTasks
-from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3.messaging import Configuration, ApiClient, MessagingApi
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, Request, HTTPException, Depends, Header
+from typing import Optional
 from pydantic import BaseModel
+import logging
 
-from app.config import settings
-from app.services.linebot_service import get_line_service, LineBotService
+from app.services.linebot_service import LineBotService
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/linebot", tags=["LINE Bot"])
 
-# Initialize LINE SDK components
-configuration = Configuration(access_token=settings.CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(settings.CHANNEL_SECRET)
+async def get_line_service(request: Request) -> LineBotService:
+    """
+    Dependency to get the LINE Bot service singleton.
 
-# 緩存 LINE Bot 服務實例
-_line_service_instance = None
+    服務在 lifespan 啟動時建立，這裡僅讀取 app.state。
 
-async def get_line_service():
-    """
-    Dependency to get LINE Bot service.
-    
     Returns:
         LineBotService: Instance of LINE Bot service.
     """
-    global _line_service_instance
-    
-    # 如果已經有實例，直接返回
-    if _line_service_instance is not None:
-        return _line_service_instance
-    
-    # 建立新實例，並進行初始化
-    with ApiClient(configuration) as api_client:
-        line_api = MessagingApi(api_client)
-        _line_service_instance = LineBotService(line_api, handler)
-        await _line_service_instance.initialize()
-        return _line_service_instance
+    return request.app.state.line_service
 
 @router.post("/webhook")
 async def webhook(
-    request: Request, 
+    request: Request,
     x_line_signature: Optional[str] = Header(None),
     line_service: LineBotService = Depends(get_line_service)
 ):
     """
     LINE Bot webhook endpoint.
-    
+
+    先驗證簽章（便宜的 HMAC 計算），事件處理整個交給獨立任務，
+    讓 LINE 立刻收到 200 回應（LINE 對 webhook 的等待預算很短）。
+
     Args:
         request (Request): The incoming webhook request.
         x_line_signature (str): LINE signature header.
         line_service (LineBotService): LINE Bot service instance.
-        
+
     Returns:
         dict: Response message.
     """
     if x_line_signature is None:
         raise HTTPException(status_code=400, detail="X-Line-Signature header is missing")
-        
-    # Get request body as text
+
+    # body 全程維持 bytes：HMAC 直接算在 bytes 上，orjson 也接受 bytes，
+    # 不需要 decode + SDK 內部 re-encode 的往返
     body = await request.body()
-    body_text = body.decode('utf-8')
-    
-    try:
-        # Process webhook body with handler
-        line_service.handle_webhook(body_text, x_line_signature)
-    except InvalidSignatureError:
+
+    # 簽章驗證在這裡同步完成；分派只做解析並為每個事件建立
+    # 由服務持有強引用的背景任務，await 它仍可立即回 200
+    if not line_service.verify_signature(body, x_line_signature):
         raise HTTPException(status_code=400, detail="Invalid signature")
-    except Exception as e:
-        # 記錄更詳細的錯誤信息
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Webhook 處理錯誤: {error_details}")
-        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
-    
+
+    await line_service.dispatch_webhook(body)
+
     return {"status": "ok"}
 
 # 定義請求的數據模型
@@ -100,13 +80,11 @@ async def test_push_message(
         dict: 回應訊息。
     """
     try:
-        response = line_service.push_text(request.user_id, request.message)
+        response = await line_service.push_text(request.user_id, request.message)
         return {"status": "ok", "response": response}
     except Exception as e:
-        # 記錄更詳細的錯誤信息
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"推送訊息錯誤: {error_details}")
+        # logger.exception 會附帶 traceback，格式化交由 handler 處理
+        logger.exception("推送訊息錯誤")
         raise HTTPException(status_code=500, detail=f"Failed to send message: {str(e)}")
         
 @router.get("/verify")
@@ -138,9 +116,7 @@ async def get_agents(
         agents = await line_service.agent_service.get_available_agents()
         return {"agents": agents}
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"獲取 Agent 列表錯誤: {error_details}")
+        logger.exception("獲取 Agent 列表錯誤")
         raise HTTPException(status_code=500, detail=f"Failed to get agents: {str(e)}")
 
 @router.post("/test/agent")
@@ -165,7 +141,5 @@ async def test_agent_message(
         )
         return {"status": "ok", "response": response}
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Agent 處理訊息錯誤: {error_details}")
+        logger.exception("Agent 處理訊息錯誤")
         raise HTTPException(status_code=500, detail=f"Failed to process message: {str(e)}") 
\ No newline at end of file
@@ -2,6 +2,7 @@
 Application configuration.
 """
 import os
+from functools import lru_cache
 from typing import Optional
 from pydantic_settings import BaseSettings
 from pydantic import PostgresDsn
@@ -13,6 +14,7 @@ class Settings(BaseSettings):
     # App settings
     APP_ENV: str = "development"
     LOG_LEVEL: str = "INFO"
+    THREAD_POOL_SIZE: int = 8
     
     # LINE Bot credentials
     CHANNEL_ACCESS_TOKEN: Optional[str] = None
@@ -20,6 +22,11 @@ class Settings(BaseSettings):
     
     # OpenAI API
     OPENAI_API_KEY: Optional[str] = None
+
+    # 語意回應快取
+    SEMANTIC_CACHE_ENABLED: bool = True
+    # 推測性預取下一輪回應（會產生額外的 LLM 呼叫成本，預設關閉）
+    PREFETCH_ENABLED: bool = False
     
     # Database
     DATABASE_URL: Optional[PostgresDsn] = None
@@ -33,5 +40,18 @@ class Settings(BaseSettings):
         "extra": "ignore"  # 允許額外的環境變數
     }
 
-# Create global settings object
-settings = Settings() 
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    取得 Settings 單例。
+
+    環境變數只在第一次呼叫時解析一次，之後都返回同一實例。
+    注意：下方的模組層級 `settings` 在 import 時即已觸發解析，
+    且 `from app.config import settings` 綁定的是實例本身，
+    cache_clear() 無法刷新這些呼叫點；需要重載設定的測試
+    應改用 get_settings() 存取。
+    """
+    return Settings()
+
+# 向後相容的模組層級存取點
+settings = get_settings() 
\ No newline at end of file
@@ -3,8 +3,15 @@ FastAPI application entry point.
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
+import asyncio
 import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from app.config import settings
+from app.services.linebot_service import create_line_service
 from dotenv import load_dotenv
 
 # 確保 .env 文件被加載
@@ -13,16 +20,45 @@ load_dotenv()
 # 設置日誌
 logger = logging.getLogger(__name__)
 
-# 檢查關鍵環境變數
-if not settings.OPENAI_API_KEY:
-    logger.warning("未設置 OPENAI_API_KEY 環境變數，Agno Agent 可能無法正常工作")
-else:
-    logger.info(f"OPENAI_API_KEY 已設置: {settings.OPENAI_API_KEY[:5]}...")
+# 專用的執行緒池，供所有阻塞呼叫（如 Agno Agent）使用
+# 避免與 asyncio 預設執行緒池互相搶佔
+_executor = ThreadPoolExecutor(
+    max_workers=settings.THREAD_POOL_SIZE,
+    thread_name_prefix="agno"
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """應用生命週期：調整事件迴圈設定並建立單例服務。"""
+    # 關鍵憑證的檢查延後到啟動時執行，import 本模組不會觸發
+    # （設定本身仍在 app.config import 時解析一次）
+    if not settings.OPENAI_API_KEY:
+        logger.warning("未設置 OPENAI_API_KEY 環境變數，Agno Agent 可能無法正常工作")
+    else:
+        logger.info(f"OPENAI_API_KEY 已設置: {settings.OPENAI_API_KEY[:5]}...")
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(_executor)
+
+    # Python 3.12+ 支援 eager task factory：
+    # 不需要等待 I/O 的 coroutine 可以直接同步完成，省去 Task 排程開銷
+    if sys.version_info >= (3, 12):
+        loop.set_task_factory(asyncio.eager_task_factory)
+
+    # LINE Bot 服務只在啟動時建立一次，之後由 dependency 直接讀取
+    app.state.line_service = create_line_service()
+    await app.state.line_service.initialize()
+
+    yield
+
+    await app.state.line_service.aclose()
 
 app = FastAPI(
     title="AI LineBot Customer Service",
     description="API for AI-powered LINE customer service bot",
     version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Add CORS middleware
@@ -51,7 +87,21 @@ async def root():
         dict: Basic API information.
     """
     return {
-        "name": "AI LineBot Customer Service API", 
+        "name": "AI LineBot Customer Service API",
         "version": "0.1.0",
         "status": "active"
-    } 
\ No newline at end of file
+    }
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # 服務是 I/O-bound：uvloop 事件迴圈 + httptools HTTP parser，
+    # worker 數對齊 CPU 核心數（可由環境變數覆寫）
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop" if sys.platform != "win32" else "asyncio",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+    ) 
\ No newline at end of file
@@ -1,6 +1,6 @@
 """
 資料模型模組
 """
-from app.models.conversation import Conversation, Message
+from app.models.conversation import Conversation, Message, SenderType
 
-__all__ = ["Conversation", "Message"]
+__all__ = ["Conversation", "Message", "SenderType"]
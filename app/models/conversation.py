@@ -3,15 +3,38 @@
 """
 from pydantic import BaseModel, Field
 from datetime import datetime
+from enum import Enum
+from itertools import count
 from typing import List, Optional, Literal
 from uuid import UUID, uuid4
+import os
+
+# 訊息 ID 只用於內部追蹤，不需要密碼學強度的隨機性。
+# 以「啟動時一次 os.urandom 的 process 前綴 + 單調計數器」組出 UUID，
+# 省去每則訊息一次 uuid4() 的系統呼叫
+_ID_COUNTER = count()
+_PROC_PREFIX = os.urandom(8)
+
+def _next_message_id() -> UUID:
+    """產生下一個內部訊息 ID（保持 UUID 型別介面）。"""
+    return UUID(bytes=_PROC_PREFIX + next(_ID_COUNTER).to_bytes(8, "big"))
+
+class SenderType(str, Enum):
+    """訊息發送者類型。
+
+    用 Enum 取代 Literal，Pydantic 驗證走單次查表
+    而不是逐一比對字串 tuple（每則訊息都會建構一次）。
+    """
+    USER = "user"
+    BOT = "bot"
+    AGENT = "agent"
 
 class Message(BaseModel):
     """訊息模型，代表對話中的一條訊息"""
-    id: UUID = Field(default_factory=uuid4)
+    id: UUID = Field(default_factory=_next_message_id)
     conversation_id: UUID
     content: str
-    sender_type: Literal["user", "bot", "agent"]
+    sender_type: SenderType
     timestamp: datetime = Field(default_factory=datetime.now)
     
     class Config:
@@ -25,11 +48,11 @@ class Conversation(BaseModel):
     end_time: Optional[datetime] = None
     status: Literal["active", "closed"] = "active"
     messages: List[Message] = []
-    
+
     class Config:
         from_attributes = True
-    
-    def add_message(self, content: str, sender_type: Literal["user", "bot", "agent"]) -> Message:
+
+    def add_message(self, content: str, sender_type: SenderType) -> Message:
         """
         添加一條新訊息到對話中
         
@@ -47,7 +70,7 @@ class Conversation(BaseModel):
         )
         self.messages.append(message)
         return message
-    
+
     def close(self):
         """關閉對話"""
         self.status = "closed"
@@ -1,9 +1,10 @@
 """
 Agent 服務，管理各種 Agent 並路由用戶訊息。
 """
+import asyncio
 import logging
-from typing import Dict, Type, List
-from app.agents.base_agent import BaseAgent, AgentResponse
+from typing import Dict, Optional, Type, List
+from app.agents.base_agent import BaseAgent, AgentResponse, AgentUnavailableError
 from app.agents.echo_agent import EchoAgent
 from app.agents.simple_agno_agent import SimpleAgnoAgent
 
@@ -17,13 +18,13 @@ class AgentService:
     def __init__(self):
         """初始化 Agent 服務。"""
         self.agents: Dict[str, BaseAgent] = {}
+        self._agents_cache: Optional[List[Dict]] = None
         self._register_default_agents()
     
     async def initialize(self):
-        """初始化所有 Agent。"""
-        for agent_id, agent in self.agents.items():
-            logger.info(f"初始化 Agent: {agent_id}")
-            await agent.initialize()
+        """初始化所有 Agent（並行執行，啟動時間取決於最慢的一個）。"""
+        logger.info(f"並行初始化 {len(self.agents)} 個 Agent: {list(self.agents)}")
+        await asyncio.gather(*(agent.initialize() for agent in self.agents.values()))
     
     def _register_default_agents(self):
         """註冊預設的 Agent。"""
@@ -42,6 +43,7 @@ class AgentService:
             agent: Agent 實例
         """
         self.agents[agent_id] = agent
+        self._agents_cache = None  # 註冊新 Agent 後使快取失效
         logger.info(f"已註冊 Agent: {agent_id} ({agent.name})")
     
     async def process_message(self, user_id: str, message: str) -> str:
@@ -55,14 +57,14 @@ class AgentService:
         Returns:
             str: Agent 的回覆
         """
-        logger.debug(f"處理來自用戶 {user_id} 的訊息: {message}")
+        logger.debug("處理來自用戶 %s 的訊息: %s", user_id, message)
         
         # 簡單的命令解析，用於測試和開發
-        if message.startswith("/agent "):
+        # 先比對前 7 個字元，避免每則訊息都做 slice + split 的配置
+        if message[:7] == "/agent ":
             # 格式: /agent {agent_id} {實際訊息}
-            parts = message[7:].split(" ", 1)
-            if len(parts) == 2:
-                agent_id, actual_message = parts
+            agent_id, sep, actual_message = message[7:].partition(" ")
+            if sep:
                 if agent_id in self.agents:
                     agent = self.agents[agent_id]
                     response = await agent.process(user_id, actual_message)
@@ -81,7 +83,7 @@ class AgentService:
                 response = await agent.process(user_id, message)
                 return response.content
             except Exception as e:
-                logger.error(f"Agent 處理訊息時發生錯誤: {e}", exc_info=True)
+                logger.error("Agent 處理訊息時發生錯誤: %s", e, exc_info=True)
                 return "抱歉，處理您的訊息時發生錯誤。"
         else:
             # 如果 agno agent 不可用，嘗試使用 echo agent
@@ -91,18 +93,75 @@ class AgentService:
                     response = await agent.process(user_id, message)
                     return response.content
                 except Exception as e:
-                    logger.error(f"Echo Agent 處理訊息時發生錯誤: {e}", exc_info=True)
+                    logger.error("Echo Agent 處理訊息時發生錯誤: %s", e, exc_info=True)
                     return "抱歉，處理您的訊息時發生錯誤。"
             else:
                 return "抱歉，目前沒有可用的 Agent。"
     
+    async def stream_message(self, user_id: str, message: str):
+        """
+        以串流方式處理用戶訊息，逐塊產出回覆文字。
+
+        /agent 命令等非預設路徑回覆很短，仍走一次性的
+        process_message；一般訊息交給預設 Agent 的 stream。
+
+        Args:
+            user_id: 用戶 ID
+            message: 用戶發送的訊息
+
+        Yields:
+            str: 回覆文字片段
+
+        Raises:
+            AgentUnavailableError: 沒有任何可用的 Agent
+        """
+        if message[:7] == "/agent ":
+            yield await self.process_message(user_id, message)
+            return
+
+        agent = self.agents.get("agno") or self.agents.get("echo")
+        if agent is None:
+            raise AgentUnavailableError("抱歉，目前沒有可用的 Agent。")
+
+        async for chunk in agent.stream(user_id, message):
+            yield chunk
+
+    async def prefetch(self, user_id: str, message: str) -> str:
+        """
+        推測性地執行預設 Agent，產生候選回應。
+
+        使用隔離的 session（user_id 加後綴），
+        不會污染用戶真正的對話歷史。
+
+        Args:
+            user_id: 用戶 ID
+            message: 預測的下一則用戶訊息
+
+        Returns:
+            str: Agent 的候選回覆；無可用 Agent 時返回空字串
+        """
+        agent = self.agents.get("agno") or self.agents.get("echo")
+        if agent is None:
+            return ""
+
+        response = await agent.process(f"{user_id}#prefetch", message)
+        # confidence 0.0 是 Agent 的失敗回退訊息，不值得寫入快取
+        if response.confidence == 0.0:
+            return ""
+        return response.content
+
     async def get_available_agents(self) -> List[Dict]:
         """
         獲取所有可用的 Agent 資訊。
-        
+
+        結果在第一次呼叫後快取，直到有新 Agent 註冊才重建。
+
         Returns:
             List[Dict]: Agent 資訊列表
         """
+        if self._agents_cache is not None:
+            return self._agents_cache
+
         result = []
         for agent_id, agent in self.agents.items():
             metadata = await agent.get_metadata()
@@ -110,4 +169,5 @@ class AgentService:
                 "id": agent_id,
                 **metadata
             })
+        self._agents_cache = result
         return result 
\ No newline at end of file
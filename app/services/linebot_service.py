@@ -1,206 +1,426 @@
 """
 LINE Bot service for handling LINE webhook events.
 """
-from linebot.v3 import WebhookHandler
-from linebot.v3.messaging import MessagingApi, Configuration, ApiClient
-from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from linebot.v3.messaging import TextMessage
-from linebot.v3.messaging.models import ReplyMessageRequest, PushMessageRequest
-from linebot.v3.messaging.exceptions import ApiException
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import base64
+import hmac
+import httpx
 import logging
+import orjson
 import traceback
 import asyncio
 
 from app.config import settings
+from app.agents.base_agent import AgentUnavailableError
+from app.models.conversation import SenderType
 from app.services.agent_service import AgentService
+from app.services.response_cache import response_cache
 from app.utils.storage import memory_storage
 
 logger = logging.getLogger(__name__)
 
-# LINE Bot 服務實例緩存
-_instance = None
+# LINE Messaging API base URL
+LINE_API_BASE_URL = "https://api.line.me"
 
-async def get_line_service() -> 'LineBotService':
+# 單次 reply/push 的上限秒數：LINE 端點卡住時快速失敗，
+# 不讓 in-flight 任務在外部故障期間堆積
+REPLY_TIMEOUT = 3.0
+
+# 句子結尾字元：串流回覆切塊的邊界
+SENTENCE_ENDINGS = frozenset("。！？!?\n")
+
+# 預取的候選回應只短暫保留；預測錯了很快過期，不污染快取
+PREFETCH_TTL = 120.0
+# 預測下一則訊息時參考的最近對話輪數
+PREFETCH_HISTORY_SIZE = 10
+
+def create_line_service() -> 'LineBotService':
     """
-    獲取 LINE Bot 服務實例的工廠函數。
-    如果實例已存在則返回現有實例，否則創建新實例。
-    
+    建立 LINE Bot 服務實例。
+
+    由 FastAPI lifespan 在啟動時呼叫一次，
+    HTTP client 與服務共用整個 process 生命週期。
+
     Returns:
-        LineBotService: 已初始化的 LINE Bot 服務實例
+        LineBotService: LINE Bot 服務實例（尚未 initialize）
     """
-    global _instance
-    
-    if _instance is not None:
-        return _instance
-    
-    # 建立新實例
-    configuration = Configuration(access_token=settings.CHANNEL_ACCESS_TOKEN)
-    handler = WebhookHandler(settings.CHANNEL_SECRET)
-    
-    with ApiClient(configuration) as api_client:
-        line_api = MessagingApi(api_client)
-        service = LineBotService(line_api, handler)
-        await service.initialize()
-        _instance = service
-        return service
+    http_client = httpx.AsyncClient(
+        base_url=LINE_API_BASE_URL,
+        headers={
+            "Authorization": f"Bearer {settings.CHANNEL_ACCESS_TOKEN}",
+            "Content-Type": "application/json",
+        },
+        # 連線在請求之間保持 keep-alive，避免每次回覆都重付 TCP+TLS 握手
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        # 快速失敗：reply token 60 秒就過期，慢回覆等於沒回覆
+        timeout=httpx.Timeout(REPLY_TIMEOUT, connect=1.0),
+    )
+    return LineBotService(http_client)
 
 class LineBotService:
     """
     Service class for LINE Bot operations.
     """
     
-    def __init__(self, line_api: MessagingApi, handler: WebhookHandler):
+    def __init__(self, http_client: httpx.AsyncClient):
         """
         Initialize the LINE Bot service.
-        
+
         Args:
-            line_api (MessagingApi): LINE Messaging API client.
-            handler (WebhookHandler): LINE webhook handler.
+            http_client (httpx.AsyncClient): Async HTTP client for the LINE API.
         """
-        self.line_api = line_api
-        self.handler = handler
+        self.http_client = http_client
         self.agent_service = AgentService()
-        
-        # Set up event handlers
-        self._setup_event_handlers()
-        
+        # 快取 channel secret bytes，簽章驗證不需重複 encode
+        self._channel_secret = (settings.CHANNEL_SECRET or "").encode("utf-8")
+        # 預測下一則用戶訊息用的 OpenAI client（延遲建立）
+        self._openai_client = None
+        # 背景任務的強引用：事件迴圈只持有弱引用，
+        # 沒有這個集合，處理中的任務可能被 GC 回收、訊息無聲丟失
+        self._tasks: set = set()
+
         logger.info("LineBotService initialized")
-    
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """建立背景任務並保持強引用至完成為止。"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
     async def initialize(self):
         """初始化服務，包括所有 Agent。"""
         await self.agent_service.initialize()
         logger.info("Agent 服務初始化完成")
-        
-    def _setup_event_handlers(self):
+
+    def verify_signature(self, body: bytes, signature: str) -> bool:
         """
-        Set up handlers for different types of LINE events.
+        驗證 LINE webhook 簽章（HMAC-SHA256，常數時間比較）。
+
+        Args:
+            body (bytes): Raw request body.
+            signature (str): X-Line-Signature header.
+
+        Returns:
+            bool: 簽章是否有效
         """
-        # Handle text messages
-        @self.handler.add(MessageEvent, message=TextMessageContent)
-        def handle_text_message(event):
-            # 使用非同步處理，但在同步環境下執行
-            asyncio.create_task(self._async_process_text_message(event))
-    
-    def handle_webhook(self, body: str, signature: str) -> None:
+        # hmac.digest 是單次計算的最佳化路徑（OpenSSL 一次呼叫），
+        # 比較維持在 bytes 層級，不需把摘要 decode 成 str
+        mac = hmac.digest(self._channel_secret, body, "sha256")
+        expected = base64.b64encode(mac)
+        return hmac.compare_digest(expected, signature.encode("utf-8"))
+
+    async def dispatch_webhook(self, body: bytes) -> None:
         """
-        Handle incoming webhook from LINE.
-        
+        解析 webhook body 並分派事件。
+
+        簽章已在 endpoint 驗證過，這裡直接迭代事件，
+        不再進入 SDK 的 WebhookHandler 回呼註冊機制。
+
         Args:
-            body (str): Request body.
-            signature (str): X-Line-Signature header.
+            body (bytes): Raw request body（已驗證簽章）.
         """
-        logger.debug(f"Handling webhook with signature: {signature}")
         try:
-            self.handler.handle(body, signature)
-            logger.debug("Webhook handled successfully")
-        except Exception as e:
-            logger.error(f"Error handling webhook: {e}")
-            logger.debug(f"Webhook body: {body}")
-            logger.debug(f"Error traceback: {traceback.format_exc()}")
-            raise
+            events = orjson.loads(body).get("events", [])
+        except (ValueError, AttributeError) as e:
+            logger.error("Error parsing webhook body: %s", e)
+            logger.debug("Webhook body: %s", body)
+            return
+
+        for event_dict in events:
+            if (
+                event_dict.get("type") == "message"
+                and event_dict.get("message", {}).get("type") == "text"
+            ):
+                # 簽章已驗證，payload 可信：直接讀 dict 欄位，
+                # 不再經過 SDK pydantic 模型的逐欄位驗證
+                self._spawn(self._async_process_text_message(event_dict))
     
-    async def _async_process_text_message(self, event: MessageEvent) -> None:
+    async def _async_process_text_message(self, event: Dict[str, Any]) -> None:
         """
         非同步處理文字訊息。
-        
+
         Args:
-            event (MessageEvent): The message event from LINE.
+            event (Dict[str, Any]): The message event payload from LINE.
         """
         try:
-            text = event.message.text
-            reply_token = event.reply_token
-            user_id = event.source.user_id
+            text = event["message"]["text"]
+            reply_token = event["replyToken"]
+            user_id = event["source"]["userId"]
             
-            logger.info(f"Received message from {user_id}: {text}")
+            logger.info("Received message from %s: %s", user_id, text)
             
             # 獲取或創建用戶的活躍對話
-            conversation = memory_storage.get_active_conversation(user_id)
-            
-            # 記錄用戶訊息
-            memory_storage.add_message(conversation.id, text, "user")
-            
-            # 使用 Agent Service 處理訊息
-            response = await self.agent_service.process_message(user_id, text)
-            
-            # 記錄機器人回覆
-            memory_storage.add_message(conversation.id, response, "bot")
-            
-            # 回覆用戶
-            self.reply_text(reply_token, response)
-            
+            conversation = await memory_storage.get_active_conversation(user_id)
+
+            # 語意快取：同一用戶語意相近的重複訊息直接回覆，不進 Agent/LLM
+            cached_response = None
+            embedding = None
+            if settings.SEMANTIC_CACHE_ENABLED:
+                cached_response, embedding = await response_cache.lookup(user_id, text)
+
+            if cached_response is not None:
+                # 快取命中：回覆與批次寫入並行
+                response = cached_response
+                await asyncio.gather(
+                    self.reply_text(reply_token, response),
+                    memory_storage.add_messages(
+                        conversation.id,
+                        [(text, SenderType.USER), (response, SenderType.BOT)],
+                    ),
+                )
+            else:
+                # 快取未命中：串流生成，第一個完整句子就緒即先回覆
+                response, cacheable = await self._stream_reply(user_id, reply_token, text)
+                # 失敗回退訊息不寫入快取，否則用戶重試同一問題
+                # 會在故障恢復後仍命中過期的錯誤回覆
+                if cacheable and embedding is not None and response:
+                    response_cache.store(user_id, embedding, response)
+                await memory_storage.add_messages(
+                    conversation.id,
+                    [(text, SenderType.USER), (response, SenderType.BOT)],
+                )
+
+            # 回覆已送出；利用用戶打字的空檔推測下一則訊息並預溫快取
+            if settings.PREFETCH_ENABLED:
+                self._spawn(self._prefetch_next(user_id, conversation))
+
         except Exception as e:
-            logger.error(f"處理訊息時發生錯誤: {e}")
-            logger.debug(f"錯誤詳情: {traceback.format_exc()}")
+            logger.error("處理訊息時發生錯誤: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("錯誤詳情: %s", traceback.format_exc())
             # 發生錯誤時，回覆一個友好的錯誤訊息
             error_message = "抱歉，我暫時無法理解您的請求。請稍後再試。"
-            self.reply_text(event.reply_token, error_message)
-            
+            await self.reply_text(event["replyToken"], error_message)
+
             # 如果對話已經創建，記錄錯誤回覆
             try:
-                conversation = memory_storage.get_active_conversation(event.source.user_id)
-                memory_storage.add_message(conversation.id, error_message, "bot")
+                conversation = await memory_storage.get_active_conversation(event["source"]["userId"])
+                await memory_storage.add_message(conversation.id, error_message, SenderType.BOT)
             except Exception as storage_error:
-                logger.error(f"記錄錯誤回覆時出現問題: {storage_error}")
+                logger.error("記錄錯誤回覆時出現問題: %s", storage_error)
     
-    def reply_text(self, reply_token: str, text: str) -> Dict[str, Any]:
+    async def _stream_reply(self, user_id: str, reply_token: str, text: str) -> Tuple[str, bool]:
+        """
+        串流生成回覆並分段送出。
+
+        LINE 的 replyMessage 本身不支援串流，但把第一個完整句子
+        用 reply 先送出、其餘生成完後以 push 補上，用戶看到首段的
+        延遲就接近 LLM 的首 token 延遲而不是完整生成時間。
+
+        Args:
+            user_id: 用戶 ID
+            reply_token: 事件的 reply token
+            text: 用戶訊息
+
+        Returns:
+            (回覆文字, 是否可寫入語意快取)；生成失敗或回退訊息
+            一律標記為不可快取
+        """
+        parts: List[str] = []
+        first_prefix_len = 0
+        first_sent_task = None
+
+        try:
+            async for chunk in self.agent_service.stream_message(user_id, text):
+                parts.append(chunk)
+                if first_sent_task is not None:
+                    continue
+
+                # 找到第一個句子邊界就先回覆，不等整段生成
+                accumulated = "".join(parts)
+                boundary = next(
+                    (i for i, ch in enumerate(accumulated) if ch in SENTENCE_ENDINGS),
+                    None,
+                )
+                if boundary is not None:
+                    first_sentence = accumulated[:boundary + 1].strip()
+                    if first_sentence:
+                        first_prefix_len = boundary + 1
+                        first_sent_task = asyncio.create_task(
+                            self.reply_text(reply_token, first_sentence)
+                        )
+        except AgentUnavailableError as e:
+            # Agent 不可用：回覆說明文字，但不進快取
+            message = str(e)
+            await self.reply_text(reply_token, message)
+            return message, False
+        except Exception as e:
+            logger.error("串流生成回覆失敗: %s", e)
+            if first_sent_task is not None:
+                # 首句已送出，放棄不完整的剩餘內容
+                await first_sent_task
+                return "".join(parts), False
+            error_message = "抱歉，處理您的請求時發生錯誤，請稍後再試"
+            await self.reply_text(reply_token, error_message)
+            return error_message, False
+
+        response = "".join(parts)
+
+        if first_sent_task is None:
+            # 整段回覆裡沒有句子邊界（或為空），一次送出
+            await self.reply_text(reply_token, response or "抱歉，我暫時無法回應。")
+            return response, bool(response)
+
+        await first_sent_task
+        remainder = response[first_prefix_len:].strip()
+        if remainder:
+            await self.push_text(user_id, remainder)
+        return response, True
+
+    def _get_openai_client(self):
+        """延遲建立 AsyncOpenAI client；未設定 API key 時返回 None。"""
+        if self._openai_client is None:
+            if not settings.OPENAI_API_KEY:
+                return None
+            from openai import AsyncOpenAI
+            self._openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        return self._openai_client
+
+    async def _predict_next_message(self, conversation) -> Optional[str]:
+        """
+        根據最近的對話輪次，預測用戶最可能的下一則訊息。
+
+        Args:
+            conversation: 用戶的活躍對話
+
+        Returns:
+            預測的訊息文字；無法預測時返回 None
+        """
+        client = self._get_openai_client()
+        if client is None:
+            return None
+
+        recent = conversation.messages[-PREFETCH_HISTORY_SIZE:]
+        if not recent:
+            return None
+
+        transcript = "\n".join(
+            f"{m.sender_type.value}: {m.content}" for m in recent
+        )
+        completion = await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {
+                    "role": "system",
+                    "content": (
+                        "根據以下客服對話，預測用戶最可能接著發送的一則訊息。"
+                        "只輸出那則訊息本身；如果無法合理預測，輸出「無」。"
+                    ),
+                },
+                {"role": "user", "content": transcript},
+            ],
+            max_tokens=60,
+            temperature=0.3,
+        )
+        predicted = (completion.choices[0].message.content or "").strip()
+        if not predicted or predicted == "無":
+            return None
+        return predicted
+
+    async def _prefetch_next(self, user_id: str, conversation) -> None:
+        """
+        推測性預取：預測下一則用戶訊息，預先生成回應寫入語意快取。
+
+        預取失敗只影響快取命中率，不影響正常流程，
+        所有錯誤都就地吞掉。
+
+        Args:
+            user_id: 用戶 ID
+            conversation: 用戶的活躍對話
+        """
+        try:
+            predicted = await self._predict_next_message(conversation)
+            if not predicted:
+                return
+
+            embedding = await response_cache.embed(predicted)
+            if embedding is None:
+                return
+            # 該用戶已有語意相近的快取就不浪費一次生成
+            if await asyncio.to_thread(response_cache.find, user_id, embedding) is not None:
+                return
+
+            candidate = await self.agent_service.prefetch(user_id, predicted)
+            if candidate:
+                response_cache.store(user_id, embedding, candidate, ttl=PREFETCH_TTL)
+                logger.debug("已預取候選回應: %s", predicted)
+        except Exception as e:
+            logger.debug("預取下一輪回應失敗: %s", e)
+
+    async def reply_text(self, reply_token: str, text: str) -> Dict[str, Any]:
         """
         Reply to a message with text.
-        
+
         Args:
             reply_token (str): The reply token from the event.
             text (str): The text to send.
-            
+
         Returns:
             Dict[str, Any]: Response from LINE API.
         """
         try:
-            logger.debug(f"Replying to token {reply_token} with text: {text}")
-            message = TextMessage(text=text)
-            
-            # 創建 ReplyMessageRequest 物件
-            reply_request = ReplyMessageRequest(
-                replyToken=reply_token,
-                messages=[message]
+            logger.debug("Replying to token %s with text: %s", reply_token, text)
+            response = await asyncio.wait_for(
+                self.http_client.post(
+                    "/v2/bot/message/reply",
+                    content=orjson.dumps({
+                        "replyToken": reply_token,
+                        "messages": [{"type": "text", "text": text}]
+                    })
+                ),
+                timeout=REPLY_TIMEOUT,
             )
-            
-            # 使用 ReplyMessageRequest 物件調用 reply_message 方法
-            response = self.line_api.reply_message(reply_message_request=reply_request)
-            
-            logger.info(f"Message sent successfully with reply token: {reply_token}")
-            return response
-        except ApiException as e:
-            logger.error(f"LINE API error when replying: {e}")
-            logger.debug(f"Error traceback: {traceback.format_exc()}")
+            response.raise_for_status()
+
+            logger.info("Message sent successfully with reply token: %s", reply_token)
+            return response.json() if response.content else {}
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            # reply token 很快過期，逾時就放棄，不讓任務堆積
+            logger.warning("LINE API reply timed out, dropping (token %s): %s", reply_token, e)
+            return {}
+        except httpx.HTTPError as e:
+            logger.error("LINE API error when replying: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Error traceback: %s", traceback.format_exc())
             raise
-    
-    def push_text(self, user_id: str, text: str) -> Dict[str, Any]:
+
+    async def push_text(self, user_id: str, text: str) -> Dict[str, Any]:
         """
         Push a text message to a user.
-        
+
         Args:
             user_id (str): User ID to send message to.
             text (str): The text to send.
-            
+
         Returns:
             Dict[str, Any]: Response from LINE API.
         """
         try:
-            logger.debug(f"Pushing message to user {user_id}: {text}")
-            message = TextMessage(text=text)
-            
-            # 創建 PushMessageRequest 物件
-            push_request = PushMessageRequest(
-                to=user_id,
-                messages=[message]
+            logger.debug("Pushing message to user %s: %s", user_id, text)
+            response = await asyncio.wait_for(
+                self.http_client.post(
+                    "/v2/bot/message/push",
+                    content=orjson.dumps({
+                        "to": user_id,
+                        "messages": [{"type": "text", "text": text}]
+                    })
+                ),
+                timeout=REPLY_TIMEOUT,
             )
-            
-            # 使用 PushMessageRequest 物件調用 push_message 方法
-            response = self.line_api.push_message(push_message_request=push_request)
-            
-            logger.info(f"Message pushed successfully to user: {user_id}")
-            return response
-        except ApiException as e:
-            logger.error(f"LINE API error when pushing: {e}")
-            logger.debug(f"Error traceback: {traceback.format_exc()}")
-            raise 
\ No newline at end of file
+            response.raise_for_status()
+
+            logger.info("Message pushed successfully to user: %s", user_id)
+            return response.json() if response.content else {}
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            logger.warning("LINE API push timed out, dropping (user %s): %s", user_id, e)
+            return {}
+        except httpx.HTTPError as e:
+            logger.error("LINE API error when pushing: %s", e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Error traceback: %s", traceback.format_exc())
+            raise
+
+    async def aclose(self) -> None:
+        """關閉底層的 HTTP client。"""
+        await self.http_client.aclose()
\ No newline at end of file
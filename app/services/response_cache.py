@@ -0,0 +1,176 @@
+"""
+語意回應快取 - 在呼叫 Agent 之前攔截語意相近的重複訊息。
+
+LLM 呼叫是整條路徑的延遲大宗；常見的寒暄與重複問題
+可以直接以快取回應，不必每次都付完整生成的成本。
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 嵌入模型（輕量，延遲遠低於對話模型）
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+class SemanticCache:
+    """
+    以嵌入相似度為鍵的回應快取，按用戶分區。
+
+    回應是在各用戶自己的 Agent session（帶對話歷史）下生成的，
+    可能包含訂單編號等個人內容，因此只對同一用戶命中，
+    絕不跨用戶共用。查詢時在該用戶的項目中取 top-1 cosine
+    相似度，超過門檻即視為命中。嵌入本身與用戶無關，
+    另以 SHA-256(text) 全域快取，相同文字不重複呼叫嵌入 API。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: float = 3600.0,
+        threshold: float = 0.92,
+    ):
+        """
+        初始化快取。
+
+        Args:
+            maxsize: 保留的 (embedding, response) 筆數上限
+            ttl: 快取項目的存活秒數
+            threshold: 視為命中的最低 cosine 相似度
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        # (user_id, embedding, response, expires_at)，依寫入順序淘汰
+        self._entries: List[Tuple[str, List[float], str, float]] = []
+        # SHA-256(text) -> embedding，避免相同文字重複嵌入
+        self._embeddings: OrderedDict[str, List[float]] = OrderedDict()
+        self._client = None
+
+    def _get_client(self):
+        """延遲建立 AsyncOpenAI client；未設定 API key 時返回 None。"""
+        if self._client is None:
+            if not settings.OPENAI_API_KEY:
+                return None
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+        return self._client
+
+    async def embed(self, text: str) -> Optional[List[float]]:
+        """
+        取得文字的嵌入向量（先查本地快取）。
+
+        Args:
+            text: 要嵌入的文字
+
+        Returns:
+            嵌入向量；嵌入不可用或失敗時返回 None
+        """
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        cached = self._embeddings.get(key)
+        if cached is not None:
+            self._embeddings.move_to_end(key)
+            return cached
+
+        client = self._get_client()
+        if client is None:
+            return None
+
+        try:
+            result = await client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        except Exception as e:
+            logger.warning("計算嵌入失敗，略過語意快取: %s", e)
+            return None
+
+        embedding = result.data[0].embedding
+        self._embeddings[key] = embedding
+        if len(self._embeddings) > self.maxsize:
+            self._embeddings.popitem(last=False)
+        return embedding
+
+    def find(self, user_id: str, embedding: List[float]) -> Optional[str]:
+        """
+        以嵌入向量查詢該用戶最相似的快取回應。
+
+        Args:
+            user_id: 用戶 ID（只在此用戶的項目中查詢）
+            embedding: 查詢向量
+
+        Returns:
+            命中的回應；無命中時返回 None
+        """
+        now = time.monotonic()
+        # find 會在執行緒池中執行（lookup 與預取查重都經 to_thread），
+        # 這裡只讀取快照、跳過過期項目，不回寫 self._entries——
+        # 從工作執行緒重建列表會與事件迴圈上的 store() 競爭，
+        # 讓同時寫入的項目無聲遺失；清理交給 store() 做
+        entries = self._entries
+
+        best_score = 0.0
+        best_response = None
+        for cached_user_id, cached_embedding, response, expires_at in entries:
+            if cached_user_id != user_id or expires_at <= now:
+                continue
+            # OpenAI 嵌入已正規化，內積即 cosine 相似度
+            score = sum(a * b for a, b in zip(embedding, cached_embedding))
+            if score > best_score:
+                best_score = score
+                best_response = response
+
+        if best_response is not None and best_score >= self.threshold:
+            logger.debug("語意快取命中 (相似度 %.3f)", best_score)
+            return best_response
+        return None
+
+    async def lookup(self, user_id: str, text: str) -> Tuple[Optional[str], Optional[List[float]]]:
+        """
+        查詢文字對該用戶的快取回應。
+
+        Args:
+            user_id: 用戶 ID
+            text: 用戶訊息
+
+        Returns:
+            (命中的回應或 None, 嵌入向量或 None)；
+            嵌入向量可交給 store() 重用，不需重算
+        """
+        embedding = await self.embed(text)
+        if embedding is None:
+            return None, None
+        # 相似度掃描是純 Python 浮點運算（O(筆數×維度)），
+        # 丟到執行緒池執行，不阻塞事件迴圈上的其他用戶
+        return await asyncio.to_thread(self.find, user_id, embedding), embedding
+
+    def store(
+        self,
+        user_id: str,
+        embedding: List[float],
+        response: str,
+        ttl: Optional[float] = None,
+    ) -> None:
+        """
+        為指定用戶寫入一筆 (embedding, response)。
+
+        Args:
+            user_id: 用戶 ID
+            embedding: 訊息的嵌入向量
+            response: Agent 的回應
+            ttl: 覆寫預設存活秒數（如預取結果可給較短 TTL）
+        """
+        now = time.monotonic()
+        expires_at = now + (ttl if ttl is not None else self.ttl)
+        # store 只在事件迴圈執行緒上呼叫：過期清理集中在這裡，
+        # 組好新列表後一次性替換，find 的快照讀取不受影響
+        entries = [e for e in self._entries if e[3] > now]
+        entries.append((user_id, embedding, response, expires_at))
+        if len(entries) > self.maxsize:
+            entries.pop(0)
+        self._entries = entries
+
+# 全局語意快取實例
+response_cache = SemanticCache()
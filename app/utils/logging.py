@@ -1,43 +1,59 @@
 """
 Logging configuration and utilities.
 """
+import atexit
 import logging
 import sys
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from typing import Optional
 
 def setup_logger(
-    name: str, 
-    level: int = logging.INFO, 
+    name: str,
+    level: int = logging.INFO,
     format_str: Optional[str] = None
 ) -> logging.Logger:
     """
     Configure and return a logger with the given name and level.
-    
+
+    重複以同一個 name 呼叫不會累積 handler；已設置過的 logger
+    直接返回。實際的格式化與 stdout I/O 由背景 QueueListener
+    執行緒處理，呼叫端只付一次 queue put 的成本。
+
     Args:
         name (str): Name of the logger.
         level (int): Logging level.
         format_str (Optional[str]): Format string for the logger.
             If None, a default format is used.
-            
+
     Returns:
         logging.Logger: Configured logger.
     """
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+
     if format_str is None:
         format_str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        
+
     formatter = logging.Formatter(format_str)
-    
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(formatter)
-    
-    logger = logging.getLogger(name)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    # 記錄先進 queue，I/O 由背景執行緒消化，不佔用事件迴圈
+    log_queue: SimpleQueue = SimpleQueue()
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(QueueHandler(log_queue))
     logger.setLevel(level)
-    logger.addHandler(handler)
-    
+
     # Prevent duplicate logs
     logger.propagate = False
-    
+
     return logger
 
 # Default application logger
-app_logger = setup_logger("app") 
\ No newline at end of file
+app_logger = setup_logger("app")
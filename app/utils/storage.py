@@ -2,17 +2,77 @@
 簡易儲存工具 - 用於在記憶體中儲存對話記錄
 在實際生產環境中，這應該替換為資料庫儲存
 """
-from typing import Dict, List, Optional
+import asyncio
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
 from uuid import UUID
-from app.models.conversation import Conversation, Message
+from app.models.conversation import Conversation, Message, SenderType
+
+# 記憶體中保留的對話數上限
+MAX_CONVERSATIONS = 10_000
+# 對話閒置多久後淘汰（秒）
+CONVERSATION_TTL = 60 * 60 * 24
 
 class MemoryStorage:
-    """記憶體儲存類，管理對話和訊息"""
-    
+    """記憶體儲存類，管理對話和訊息
+
+    對話數量以 LRU + 閒置 TTL 設上限，長時間運行不會無限增長。
+    """
+
     def __init__(self):
         """初始化儲存"""
-        self.conversations: Dict[UUID, Conversation] = {}
+        # 依最近活動排序（OrderedDict 尾端 = 最新），供 LRU 淘汰
+        self.conversations: "OrderedDict[UUID, Conversation]" = OrderedDict()
         self.user_conversations: Dict[str, List[UUID]] = {}
+        # user_id -> 活躍對話ID 的直接索引，避免每則訊息線性掃描
+        self.active: Dict[str, UUID] = {}
+        # 同一用戶的讀寫以鎖序列化，避免並發 webhook 造成
+        # check-then-insert 競態（重複對話、訊息遺失）；跨用戶仍可並行
+        self._user_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # conversation_id -> 最近活動時間（monotonic），供 TTL 淘汰
+        self._last_active: Dict[UUID, float] = {}
+
+    def _touch(self, conversation_id: UUID) -> None:
+        """更新對話的最近活動時間並移到 LRU 尾端"""
+        self._last_active[conversation_id] = time.monotonic()
+        self.conversations.move_to_end(conversation_id)
+
+    def _evict(self, conversation_id: UUID) -> None:
+        """移除一個對話及其所有索引"""
+        conversation = self.conversations.pop(conversation_id, None)
+        self._last_active.pop(conversation_id, None)
+        if conversation is None:
+            return
+
+        user_id = conversation.user_id
+        conv_ids = self.user_conversations.get(user_id)
+        if conv_ids is not None:
+            try:
+                conv_ids.remove(conversation_id)
+            except ValueError:
+                pass
+            if not conv_ids:
+                del self.user_conversations[user_id]
+                # 注意：不淘汰 _user_locks 裡的鎖。若在有人持有或等待時
+                # 移除，defaultdict 會為同一用戶再造一把新鎖，兩個協程
+                # 便可同時進入臨界區——正是鎖要防的競態。鎖本身很小，
+                # 數量以不同用戶數為上界，留著即可。
+        if self.active.get(user_id) == conversation_id:
+            del self.active[user_id]
+
+    def _evict_stale(self) -> None:
+        """淘汰閒置逾時的對話，並讓總量維持在上限內"""
+        now = time.monotonic()
+        # OrderedDict 頭端即最久未活動的對話
+        while self.conversations:
+            oldest_id = next(iter(self.conversations))
+            if now - self._last_active.get(oldest_id, now) > CONVERSATION_TTL:
+                self._evict(oldest_id)
+            else:
+                break
+        while len(self.conversations) >= MAX_CONVERSATIONS:
+            self._evict(next(iter(self.conversations)))
     
     def create_conversation(self, user_id: str) -> Conversation:
         """
@@ -24,14 +84,18 @@ class MemoryStorage:
         Returns:
             新創建的對話
         """
+        self._evict_stale()
+
         conversation = Conversation(user_id=user_id)
         self.conversations[conversation.id] = conversation
+        self._last_active[conversation.id] = time.monotonic()
         
-        # 添加到用戶的對話列表
+        # 添加到用戶的對話列表，並更新活躍索引
         if user_id not in self.user_conversations:
             self.user_conversations[user_id] = []
         self.user_conversations[user_id].append(conversation.id)
-        
+        self.active[user_id] = conversation.id
+
         return conversation
     
     def get_conversation(self, conversation_id: UUID) -> Optional[Conversation]:
@@ -46,46 +110,78 @@ class MemoryStorage:
         """
         return self.conversations.get(conversation_id)
     
-    def get_active_conversation(self, user_id: str) -> Optional[Conversation]:
+    async def get_active_conversation(self, user_id: str) -> Optional[Conversation]:
         """
         獲取用戶的活躍對話，如果沒有則創建新對話
-        
+
         Args:
             user_id: 用戶ID
-            
+
         Returns:
             活躍對話
         """
-        # 檢查用戶是否有對話
-        if user_id in self.user_conversations:
-            for conv_id in reversed(self.user_conversations[user_id]):
+        async with self._user_locks[user_id]:
+            # 直接查活躍索引
+            conv_id = self.active.get(user_id)
+            if conv_id is not None:
                 conv = self.conversations.get(conv_id)
-                if conv and conv.status == "active":
+                if conv is not None:
+                    self._touch(conv_id)
                     return conv
-        
-        # 沒有活躍對話，創建新對話
-        return self.create_conversation(user_id)
+
+            # 沒有活躍對話，創建新對話
+            return self.create_conversation(user_id)
     
-    def add_message(self, 
-                   conversation_id: UUID, 
-                   content: str, 
-                   sender_type: str) -> Optional[Message]:
+    async def add_message(self,
+                         conversation_id: UUID,
+                         content: str,
+                         sender_type: SenderType) -> Optional[Message]:
         """
         添加訊息到對話
-        
+
         Args:
             conversation_id: 對話ID
             content: 訊息內容
             sender_type: 發送者類型
-            
+
         Returns:
             新添加的訊息，如果對話不存在則返回None
         """
         conversation = self.get_conversation(conversation_id)
         if not conversation:
             return None
-        
-        return conversation.add_message(content, sender_type)
+
+        async with self._user_locks[conversation.user_id]:
+            self._touch(conversation_id)
+            return conversation.add_message(content, sender_type)
+
+    async def add_messages(self,
+                          conversation_id: UUID,
+                          entries: List[Tuple[str, SenderType]]) -> List[Message]:
+        """
+        一次添加多條訊息到對話
+
+        一輪對話通常產生兩條訊息（用戶 + 機器人）；
+        批次寫入只取得一次鎖，之後換成資料庫後端時
+        也只需一個批次 INSERT 而不是逐條來回。
+
+        Args:
+            conversation_id: 對話ID
+            entries: (訊息內容, 發送者類型) 列表
+
+        Returns:
+            新添加的訊息列表，如果對話不存在則返回空列表
+        """
+        conversation = self.get_conversation(conversation_id)
+        if not conversation:
+            return []
+
+        async with self._user_locks[conversation.user_id]:
+            self._touch(conversation_id)
+            return [
+                conversation.add_message(content, sender_type)
+                for content, sender_type in entries
+            ]
     
     def close_conversation(self, conversation_id: UUID) -> bool:
         """
@@ -100,8 +196,11 @@ class MemoryStorage:
         conversation = self.get_conversation(conversation_id)
         if not conversation:
             return False
-        
+
         conversation.close()
+        # 關閉的是活躍對話時，移除索引
+        if self.active.get(conversation.user_id) == conversation_id:
+            del self.active[conversation.user_id]
         return True
     
     def get_user_conversations(self, user_id: str) -> List[Conversation]: